@@ -11,14 +11,16 @@ ESP32 to drive the external GPU fan from 0 → 100 % duty cycle.
 
 Dependencies (see requirements.txt):
   • pyserial – serial port enumeration / IO
+  • pyserial-asyncio – non-blocking serial IO for the monitoring loop
   • nvidia-ml-py3 (pynvml) – NVML bindings for GPU telemetry
 
 Usage:
-  python3 gpu_fan_controller.py [--high 80] [--low 50] [--port /dev/ttyUSB0]
+  python3 gpu_fan_controller.py [--high 80] [--low 50] [--hysteresis 3] [--port /dev/ttyUSB0]
 
-  --high  High-temperature threshold in °C to enable the fan (default: 80)
-  --low   Low-temperature threshold in °C to disable the fan (default: 50)
-          (hysteresis prevents rapid toggling)
+  --high        High-temperature threshold in °C to enable the fan (default: 80)
+  --low         Low-temperature threshold in °C to disable the fan (default: 50)
+  --hysteresis  °C the GPU must cool down before the fan slows again (default: 3)
+                (prevents rapid toggling around a curve step)
   --port  Explicit serial port. If omitted, the script auto-detects.
 
 The script prints basic status information so it can be run as a systemd
@@ -28,13 +30,17 @@ service or from the terminal.
 from __future__ import annotations
 
 import argparse
+import asyncio
 import logging
+import os
+import select
 import sys
 import time
 from typing import Optional
 
 import serial  # type: ignore
 import serial.tools.list_ports  # type: ignore
+import serial_asyncio  # type: ignore
 from pynvml import (  # type: ignore
     nvmlDeviceGetHandleByIndex,
     nvmlDeviceGetTemperature,
@@ -46,11 +52,19 @@ from pynvml import (  # type: ignore
 import textwrap  # after other imports
 
 BAUD_RATE = 115200  # Must match SERIAL_BAUD_RATE on the ESP32
-ESP32_VID_PID_CANDIDATES = {
+OK_TERMINATOR = b"OK\r\n"  # Utilities::printOK() ends every reply with println("\r\nOK")
+POLL_INTERVAL = 1.0  # NVML polling interval in seconds
+# Upper bound for a booting board to answer 'identity' after the port is opened.
+# A board that resets on open runs setup() first (WiFi connect up to 20 s,
+# NTP sync up to 10 s) before its serial command handler is live.
+READY_TIMEOUT = 40.0
+# Pre-encoded "gpufan <speed>" commands, indexed by speed percentage
+GPUFAN_CMDS = tuple(f"gpufan {i}\n".encode() for i in range(101))
+ESP32_VID_PID_CANDIDATES = frozenset({
     (0x10C4, 0xEA60),  # CP210x USB-to-UART (SiLabs) – common on ESP32 devkits
     (0x1A86, 0x7523),  # CH340/CH341 USB-Serial IC
     (0x303A, 0x1001),  # Espressif native USB (esp32-s3)
-}
+})
 
 LOGGER = logging.getLogger("gpu_fan_controller")
 
@@ -61,85 +75,197 @@ def find_esp32_serial_port() -> Optional[str]:
     Detection strategy:
     1. Match VID/PID against known ESP32 USB-UART bridges.
     2. Fallback to the first /dev/ttyUSB* or /dev/ttyACM* device.
-    """
-    ports = list(serial.tools.list_ports.comports())
 
-    # Primary: VID/PID match
-    for port in ports:
-        if port.vid is not None and port.pid is not None:
-            if (port.vid, port.pid) in ESP32_VID_PID_CANDIDATES:
-                return port.device
+    The port list is enumerated once; both checks happen in the same pass.
+    """
+    fallback: Optional[str] = None
 
-    # Secondary: name heuristic
-    for port in ports:
-        if "ttyUSB" in port.device or "ttyACM" in port.device:
+    for port in serial.tools.list_ports.comports():
+        # Primary: VID/PID match (ports without USB info yield (None, None))
+        if (port.vid, port.pid) in ESP32_VID_PID_CANDIDATES:
             return port.device
 
-    return None
+        # Secondary: name heuristic
+        if fallback is None and ("ttyUSB" in port.device or "ttyACM" in port.device):
+            fallback = port.device
+
+    return fallback
 
 
 def open_serial(port: str) -> serial.Serial:
     """Open a serial connection to the ESP32."""
     LOGGER.info("Opening serial port %s at %d baud", port, BAUD_RATE)
     ser = serial.Serial(port, BAUD_RATE, timeout=1)
-    # Give the microcontroller a moment after DTR toggle reset (some boards reset on open)
-    time.sleep(2)
-    # Flush any boot messages
+    try:
+        # Linux only: push received bytes to userspace immediately instead of
+        # via the tty driver's deferred work queue
+        ser.set_low_latency_mode(True)
+    except (AttributeError, NotImplementedError, OSError, ValueError):
+        LOGGER.debug("low_latency mode not supported on %s", port)
+    # Flush anything left over from before the port was opened
     ser.reset_input_buffer()
     ser.reset_output_buffer()
     return ser
 
 
+def wait_for_identity(ser: serial.Serial, timeout: float = READY_TIMEOUT) -> bool:
+    """Repeat the identity handshake while the device is booting, up to *timeout*.
+
+    Some boards reset when the port is opened (DTR/RTS auto-reset) and ignore
+    serial input until setup() has finished, so a single attempt is not enough.
+    Retrying only continues while the port produces output (boot messages); a
+    silent port fails after the first 2 s attempt. A board that did not reset
+    answers the first attempt. I/O errors (e.g. the device was unplugged) end
+    the handshake as a failure.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        try:
+            data = _query_identity(ser, timeout=min(2.0, remaining))
+        except OSError as e:  # serial.SerialException is an OSError too
+            LOGGER.error("Serial error during identity handshake: %s", e)
+            return False
+        if b"ComputerController" in data:
+            return True
+        if not data:
+            return False  # Nothing on the port, not a booting ComputerController
+        LOGGER.info("No identity reply yet, device may still be booting – retrying …")
+
+
 def verify_identity(ser: serial.Serial, timeout: float = 2.0) -> bool:
     """Send the 'identity' command and confirm the expected response.
 
     Returns True if the device identifies as ComputerController, False otherwise.
     """
+    return b"ComputerController" in _query_identity(ser, timeout)
+
+
+def _query_identity(ser: serial.Serial, timeout: float) -> bytes:
+    """Send the 'identity' command and return whatever arrives before the OK or *timeout*."""
     ser.reset_input_buffer()
+    # No flush(): the reply cannot arrive before the command has gone out, so
+    # waiting for it below (select()/os.read() on POSIX, read_until() where the
+    # port has no file descriptor) already covers the transmission
     ser.write(b"identity\n")
-    ser.flush()
 
-    deadline = time.time() + timeout
-    response: list[str] = []
+    try:
+        fd: Optional[int] = ser.fileno()
+    except (AttributeError, OSError):
+        fd = None  # No selectable descriptor (e.g. Windows)
+
+    if fd is None:
+        ser.timeout = timeout
+        data = ser.read_until(OK_TERMINATOR, size=512)
+    else:
+        data = _read_fd_until(fd, OK_TERMINATOR, timeout, limit=512)
+    LOGGER.debug("identity response: %r", data)
+    return data
+
 
-    while time.time() < deadline:
-        line = ser.readline().decode(errors="ignore").strip()
-        if not line:
-            continue
-        response.append(line)
-        if line == "OK":
+def _read_fd_until(fd: int, terminator: bytes, timeout: float, limit: int) -> bytes:
+    """Read from *fd* until *terminator* arrives, *timeout* expires or *limit* bytes are read.
+
+    Waits in select() and pulls whatever the tty has queued with a single
+    os.read(), instead of pyserial's byte-at-a-time read loop.
+    """
+    data = bytearray()
+    deadline = time.monotonic() + timeout
+    while terminator not in data and len(data) < limit:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
             break
-    joined = "\n".join(response)
-    LOGGER.debug("identity response:\n%s", joined)
-    return "ComputerController" in joined
+        readable, _, _ = select.select([fd], [], [], remaining)
+        if not readable:
+            break
+        try:
+            chunk = os.read(fd, 4096)
+        except BlockingIOError:
+            continue  # Spurious wakeup, the port is opened with O_NONBLOCK
+        if not chunk:
+            break  # Device went away
+        data += chunk
+    return bytes(data)
 
 
 def send_fan_speed(ser: serial.Serial, speed: int) -> None:
     """Send a gpufan command to the ESP32.
 
     The StaticSerialCommands syntax expects a newline-terminated ASCII command.
+    No flush() follows the write: the bytes are handed to the tty driver and
+    transmitted in the background, and blocking is governed by the port's
+    write_timeout. Callers that close the port flush once beforehand.
     """
     speed = max(0, min(100, speed))
-    cmd = f"gpufan {speed}\n".encode()
-    LOGGER.debug("→ %s", cmd.strip().decode())
-    ser.write(cmd)
-    ser.flush()
+    LOGGER.debug("→ gpufan %d", speed)
+    ser.write(GPUFAN_CMDS[speed])
 
 
-def _calculate_speed(temp: int, low: int, high: int) -> int:
+def _calculate_speed(temp: int, low: int, high: int, inv_range: float) -> int:
     """Return a fan duty percentage based on temperature.
 
-    • ≤ 50°C → 0 %
-    • ≥ 80°C → 100 %
+    • ≤ low  → 0 %
+    • ≥ high → 100 %
     • between → linear interpolation
+
+    *inv_range* is 1 / (high - low), precomputed by the caller.
     """
-    if temp <= 50:
+    if temp <= low:
         return 0
-    if temp >= 80:
+    if temp >= high:
         return 100
-    # Linear interpolation between 50°C and 80°C
-    ratio = (temp - 50) / float(80 - 50)
-    return int(round(ratio * 100))
+    # Linear interpolation between low and high
+    return int(round((temp - low) * inv_range * 100))
+
+
+async def _open_streams(ser: serial.Serial) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """Hand an already opened (and verified) port over to asyncio.
+
+    Mirrors serial_asyncio.open_serial_connection() but reuses *ser* instead of
+    re-opening the device, which would toggle DTR and reset the ESP32.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(loop=loop)
+    protocol = asyncio.StreamReaderProtocol(reader, loop=loop)
+    transport = serial_asyncio.SerialTransport(loop, protocol, ser)
+    writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+    return reader, writer
+
+
+class FanCurve:
+    """Stateful fan curve with asymmetric hysteresis.
+
+    The fan speeds up as soon as the curve asks for more, but only slows down
+    once the temperature has dropped *hysteresis* °C below the point that
+    would justify the current speed.
+    """
+
+    def __init__(self, low: int, high: int, hysteresis: int = 3):
+        # Precompute the curve for every temperature NVML can report
+        inv_range = 1.0 / (high - low)
+        self._table = bytes(_calculate_speed(t, low, high, inv_range) for t in range(256))
+        self._hysteresis = hysteresis
+        self._prev_temp: Optional[int] = None
+        self._current_speed: int = 0  # The fan starts switched off
+
+    def update(self, temp: int) -> Optional[int]:
+        """Return the new fan speed for *temp*, or None if it should not change."""
+        if temp == self._prev_temp:
+            return None
+        self._prev_temp = temp
+
+        speed = self._table[min(temp, 255)]
+        if speed < self._current_speed:
+            # Cooling down: follow the curve shifted by the hysteresis offset
+            speed = self._table[min(temp + self._hysteresis, 255)]
+            if speed >= self._current_speed:
+                return None
+        elif speed == self._current_speed:
+            return None
+        self._current_speed = speed
+        return speed
 
 
 class GpuMonitor:
@@ -158,7 +284,7 @@ class GpuMonitor:
         nvmlShutdown()
 
 
-def run(port: Optional[str], high: int, low: int) -> None:
+def run(port: Optional[str], high: int, low: int, hysteresis: int) -> None:
     if port is None:
         port = find_esp32_serial_port()
         if port is None:
@@ -167,43 +293,83 @@ def run(port: Optional[str], high: int, low: int) -> None:
 
     ser = open_serial(port)
 
-    if not verify_identity(ser):
+    if not wait_for_identity(ser):
         LOGGER.error("Connected device did not respond to identity command as expected. Aborting.")
         sys.exit(1)
 
+    curve = FanCurve(low, high, hysteresis)
+
     gpu = GpuMonitor(index=0)
 
-    current_speed: int = 0  # Last speed sent to the ESP32 (percentage)
-    last_temp: int = 0  # Last logged temperature
-    send_fan_speed(ser, current_speed)  # Start with fan off
+    send_fan_speed(ser, 0)  # Start with fan off
 
     try:
-        while True:
-            temp = gpu.temperature()
-            desired_speed = _calculate_speed(temp, low, high)
-
-            # Only log and update when there are significant changes
-            if abs(temp - last_temp) >= 2 or abs(desired_speed - current_speed) >= 2:
-                LOGGER.info("GPU: %d°C → Fan: %d%%", temp, desired_speed)
-                last_temp = temp
-                current_speed = desired_speed
-                send_fan_speed(ser, current_speed)
-
-            # Sleep for 1 second (NVML polling interval)
-            time.sleep(1)
+        asyncio.run(_loop(ser, gpu, curve))
     except KeyboardInterrupt:
         LOGGER.info("Interrupted by user – resetting fan and exiting …")
     finally:
-        # Reset fan to 0 on exit for safety
-        send_fan_speed(ser, 0)
-        ser.close()
+        # The event loop normally resets the fan and closes the port; cover
+        # the case where it never got that far.
+        if ser.is_open:
+            send_fan_speed(ser, 0)
+            ser.flush()
+            ser.close()
         gpu.shutdown()
 
 
+async def _loop(ser: serial.Serial, gpu: GpuMonitor, curve: FanCurve) -> None:
+    """Poll the GPU once per second and forward fan speed changes to the ESP32.
+
+    The loop waits on the poll timer and on ESP32 output at the same time, so
+    replies from the firmware are handled as soon as they arrive.
+    """
+    reader, writer = await _open_streams(ser)
+    loop = asyncio.get_running_loop()
+    next_poll = loop.time()
+
+    try:
+        while True:
+            try:
+                line: Optional[bytes] = await asyncio.wait_for(
+                    reader.readline(), timeout=max(0.0, next_poll - loop.time()))
+            except asyncio.TimeoutError:
+                line = None  # Poll interval elapsed
+
+            if line:
+                LOGGER.debug("← %s", line.decode(errors="ignore").strip())
+                continue
+
+            next_poll = loop.time() + POLL_INTERVAL
+
+            # NVML calls block, keep them off the event loop
+            temp = await asyncio.to_thread(gpu.temperature)
+            new_speed = curve.update(temp)
+
+            # Only log and update when the curve asks for a different speed
+            if new_speed is not None:
+                LOGGER.info("GPU: %d°C → Fan: %d%%", temp, new_speed)
+                LOGGER.debug("→ gpufan %d", new_speed)
+                writer.write(GPUFAN_CMDS[new_speed])
+                await writer.drain()
+    except serial.SerialException as e:
+        # SerialTransport reports a vanished device through the reader (and
+        # drain()) as an exception, never as EOF
+        LOGGER.error("Serial port closed by the device – exiting (%s)", e)
+    finally:
+        # Reset fan to 0 on exit for safety
+        writer.write(GPUFAN_CMDS[0])
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except serial.SerialException:
+            pass  # The transport already failed; reported above
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="GPU temperature watcher & ESP32 fan driver")
     parser.add_argument("--high", type=int, default=80, help="High temperature threshold (°C) to turn fan on")
     parser.add_argument("--low", type=int, default=50, help="Low temperature threshold (°C) to turn fan off")
+    parser.add_argument("--hysteresis", type=int, default=3,
+                        help="Temperature drop (°C) required before the fan slows down")
     parser.add_argument("--port", type=str, help="Serial port of the ESP32 (auto-detect if omitted)")
     parser.add_argument("--log", type=str, default="info", choices=["debug", "info", "warning", "error"],
                         help="Logging level")
@@ -217,4 +383,8 @@ if __name__ == "__main__":
         LOGGER.error("--low must be lower than --high")
         sys.exit(1)
 
-    run(args.port, args.high, args.low) 
\ No newline at end of file
+    if args.hysteresis < 0:
+        LOGGER.error("--hysteresis must not be negative")
+        sys.exit(1)
+
+    run(args.port, args.high, args.low, args.hysteresis) 
\ No newline at end of file
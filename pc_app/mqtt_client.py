@@ -2,15 +2,29 @@
 """
 MQTT Client for Computer Controller
 Connects to HiveMQ Cloud and sends control commands to ESP32
+
+Settings are read from mqtt_config.json next to this script (keys: broker,
+port, username, password, tls) or, if that file is missing, from the
+MQTT_BROKER, MQTT_PORT, MQTT_USERNAME, MQTT_PASSWORD and MQTT_TLS environment
+variables. TLS defaults to on for port 8883 and off otherwise; set tls to
+true/false (or MQTT_TLS to 1/0) to override.
 """
 
 import paho.mqtt.client as mqtt
+import argparse
 import json
+import logging
+import orjson
 import time
 import sys
 import os
+import socket
+import ssl
+import threading
 from typing import Optional
 
+LOGGER = logging.getLogger("mqtt_client")
+
 # Load credentials from config file
 def load_credentials():
     """Load MQTT credentials from config file"""
@@ -22,24 +36,46 @@ def load_credentials():
                 config = json.load(f)
                 return config
         except Exception as e:
-            print(f"Error loading config: {e}")
+            LOGGER.error("Error loading config: %s", e)
     
     # Fallback to environment variables or default values
     return {
         'broker': os.getenv('MQTT_BROKER', 'your-broker-host'),
         'port': int(os.getenv('MQTT_PORT', '8883')),
         'username': os.getenv('MQTT_USERNAME', 'your-username'),
-        'password': os.getenv('MQTT_PASSWORD', 'your-password')
+        'password': os.getenv('MQTT_PASSWORD', 'your-password'),
+        'tls': os.environ['MQTT_TLS'] != '0' if 'MQTT_TLS' in os.environ else None
     }
 
 class ComputerControllerMQTT:
-    def __init__(self, broker: str, port: int = 8883, username: str = None, password: str = None):
+    def __init__(self, broker: str, port: int = 8883, username: str = None, password: str = None,
+                 tls: Optional[bool] = None):
         self.broker = broker
         self.port = port
         self.username = username
         self.password = password
-        self.client = None
+        # Without an explicit setting, use TLS on the standard MQTTS port only
+        self.tls = port == 8883 if tls is None else tls
         self.connected = False
+        self.connect_rc = None
+        self._conn_event = threading.Event()
+        
+        # One client for the whole session; paho's network thread handles
+        # reconnects with exponential backoff on its own
+        self.client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
+        self.client.on_connect = self.on_connect
+        self.client.on_connect_fail = self.on_connect_fail
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_message = self.on_message
+        self.client.on_socket_open = self.on_socket_open
+        self.client.reconnect_delay_set(min_delay=1, max_delay=30)
+        
+        if self.tls:
+            self.client.tls_set_context(ssl.create_default_context())
+        
+        # Set username/password if provided
+        if self.username and self.password:
+            self.client.username_pw_set(self.username, self.password)
         
         # Topics
         self.status_topic = "computer-controller/status"
@@ -47,123 +83,127 @@ class ComputerControllerMQTT:
         self.events_topic = "computer-controller/events"
         self.settings_topic = "computer-controller/settings"
         
-    def on_connect(self, client, userdata, flags, rc):
+    def on_connect(self, client, userdata, flags, reason_code, properties):
         """Callback when connected to MQTT broker"""
-        if rc == 0:
-            print(f"Connected to MQTT broker {self.broker}")
+        self.connect_rc = reason_code
+        if not reason_code.is_failure:
+            LOGGER.info("Connected to MQTT broker %s", self.broker)
             self.connected = True
             
             # Subscribe to status and events topics
             client.subscribe(self.status_topic)
             client.subscribe(self.events_topic)
-            print(f"Subscribed to {self.status_topic} and {self.events_topic}")
+            LOGGER.info("Subscribed to %s and %s", self.status_topic, self.events_topic)
         else:
-            print(f"Failed to connect to MQTT broker, return code: {rc}")
+            LOGGER.error("Failed to connect to MQTT broker, return code: %s", reason_code)
+        # Wake up connect() on success and failure alike
+        self._conn_event.set()
             
-    def on_disconnect(self, client, userdata, rc):
+    def on_socket_open(self, client, userdata, sock):
+        """Callback when the broker socket has been opened"""
+        # MQTT packets are small; don't let Nagle hold them back
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (AttributeError, OSError) as e:
+            LOGGER.debug("Could not set TCP_NODELAY: %s", e)
+        
+    def on_connect_fail(self, client, userdata):
+        """Callback when a reconnect attempt by the network thread fails"""
+        # Only reachable after the initial connect() succeeded; paho keeps retrying
+        LOGGER.warning("Could not reach MQTT broker %s:%d, retrying", self.broker, self.port)
+        
+    def on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
         """Callback when disconnected from MQTT broker"""
-        print(f"Disconnected from MQTT broker, return code: {rc}")
+        LOGGER.warning("Disconnected from MQTT broker, return code: %s", reason_code)
         self.connected = False
+        self.connect_rc = reason_code
+        self._conn_event.set()
         
     def on_message(self, client, userdata, msg):
         """Callback when message received"""
         try:
-            payload = msg.payload.decode('utf-8')
-            print(f"Received message on {msg.topic}: {payload}")
+            LOGGER.debug("Received message on %s: %r", msg.topic, msg.payload)
             
+            # Handlers parse the raw bytes directly, no intermediate str
             if msg.topic == self.status_topic:
-                self.handle_status_message(payload)
+                self.handle_status_message(msg.payload)
             elif msg.topic == self.events_topic:
-                self.handle_event_message(payload)
+                self.handle_event_message(msg.payload)
                 
         except Exception as e:
-            print(f"Error processing message: {e}")
+            LOGGER.error("Error processing message: %s", e)
             
-    def handle_status_message(self, payload: str):
+    def handle_status_message(self, payload: bytes):
         """Handle status messages from ESP32"""
         try:
-            data = json.loads(payload)
-            print(f"Status Update:")
-            print(f"  Uptime: {data.get('uptime', 'N/A')} seconds")
-            print(f"  WiFi RSSI: {data.get('wifi_rssi', 'N/A')} dBm")
-            print(f"  Free Heap: {data.get('free_heap', 'N/A')} bytes")
-            print(f"  PC Powered: {data.get('pc_powered', 'N/A')}")
-            print(f"  Child Lock: {data.get('child_lock', 'N/A')}")
-            print(f"  Buzzer Enabled: {data.get('buzzer_enabled', 'N/A')}")
-        except json.JSONDecodeError as e:
-            print(f"Error parsing status JSON: {e}")
+            data = orjson.loads(payload)
+            LOGGER.info("Status: uptime=%s s, WiFi RSSI=%s dBm, free heap=%s bytes, "
+                        "PC powered=%s, child lock=%s, buzzer enabled=%s",
+                        data.get('uptime', 'N/A'), data.get('wifi_rssi', 'N/A'),
+                        data.get('free_heap', 'N/A'), data.get('pc_powered', 'N/A'),
+                        data.get('child_lock', 'N/A'), data.get('buzzer_enabled', 'N/A'))
+        except orjson.JSONDecodeError as e:
+            LOGGER.error("Error parsing status JSON: %s", e)
             
-    def handle_event_message(self, payload: str):
+    def handle_event_message(self, payload: bytes):
         """Handle event messages from ESP32"""
         try:
-            data = json.loads(payload)
+            data = orjson.loads(payload)
             event = data.get('event', 'unknown')
             event_data = data.get('data', '')
             timestamp = data.get('timestamp', 'N/A')
-            print(f"Event: {event} (data: {event_data}) at {timestamp}")
-        except json.JSONDecodeError as e:
-            print(f"Error parsing event JSON: {e}")
+            LOGGER.info("Event: %s (data: %s) at %s", event, event_data, timestamp)
+        except orjson.JSONDecodeError as e:
+            LOGGER.error("Error parsing event JSON: %s", e)
     
     def connect(self) -> bool:
         """Connect to MQTT broker"""
         try:
-            self.client = mqtt.Client()
-            self.client.on_connect = self.on_connect
-            self.client.on_disconnect = self.on_disconnect
-            self.client.on_message = self.on_message
-            
-            # Set username/password if provided
-            if self.username and self.password:
-                self.client.username_pw_set(self.username, self.password)
-            
-            # Connect to broker
+            # Open the first connection here so a failure is reported with its
+            # reason; the network thread takes care of any later reconnects
+            self._conn_event.clear()
             self.client.connect(self.broker, self.port, 60)
             self.client.loop_start()
             
-            # Wait for connection
-            timeout = 10
-            while not self.connected and timeout > 0:
-                time.sleep(1)
-                timeout -= 1
-                
+            # Wait for CONNACK (or a failure) from the network thread
+            self._conn_event.wait(timeout=10)
             return self.connected
             
         except Exception as e:
-            print(f"Error connecting to MQTT broker: {e}")
+            LOGGER.error("Error connecting to MQTT broker: %s", e)
             return False
     
     def disconnect(self):
         """Disconnect from MQTT broker"""
-        if self.client:
-            self.client.loop_stop()
-            self.client.disconnect()
-            self.connected = False
+        self.client.disconnect()
+        self.client.loop_stop()
+        self.connected = False
             
     def send_command(self, command: str, data: str = "") -> bool:
         """Send control command to ESP32"""
         if not self.connected:
-            print("Not connected to MQTT broker")
+            LOGGER.warning("Not connected to MQTT broker")
             return False
             
         try:
             message = {
                 "command": command,
                 "data": data,
-                "timestamp": int(time.time() * 1000)
+                "timestamp": time.time_ns() // 1_000_000
             }
             
-            payload = json.dumps(message)
+            payload = orjson.dumps(message)
             result = self.client.publish(self.control_topic, payload)
             
             if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                print(f"Command '{command}' sent successfully")
+                LOGGER.info("Command '%s' sent successfully", command)
                 return True
             else:
-                print(f"Failed to send command '{command}', return code: {result.rc}")
+                LOGGER.error("Failed to send command '%s', return code: %s", command, result.rc)
                 return False
                 
         except Exception as e:
-            print(f"Error sending command: {e}")
+            LOGGER.error("Error sending command: %s", e)
             return False
     
     def power_on(self) -> bool:
@@ -188,6 +228,15 @@ class ComputerControllerMQTT:
 
 def main():
     """Main function with interactive menu"""
+    parser = argparse.ArgumentParser(description="Computer Controller MQTT client")
+    parser.add_argument("--quiet", action="store_true",
+                        help="Only log warnings and errors")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO,
+                        format="%(asctime)s | %(levelname)-8s | %(name)s: %(message)s",
+                        datefmt="%H:%M:%S")
+
     # Load MQTT Configuration from config file
     config = load_credentials()
     
@@ -196,7 +245,8 @@ def main():
         config['broker'], 
         config['port'], 
         config['username'], 
-        config['password']
+        config['password'],
+        config.get('tls')
     )
     
     # Connect to broker